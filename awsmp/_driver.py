@@ -1,11 +1,31 @@
 import csv
-import json
 import logging
-from typing import IO, Dict, List, Literal, Optional
+import time
+from functools import cached_property, lru_cache, wraps
+from operator import itemgetter
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads  # type:ignore
+
 from . import changesets, models
 from .errors import (
     AccessDeniedException,
@@ -18,11 +38,37 @@ from .types import ChangeSetReturnType, ChangeSetType
 
 logger = logging.getLogger(__name__)
 
+# ChangeSetName only accepts word characters, whitespace and +=.:@-
+_CHANGESET_NAME_TABLE = str.maketrans({",": "_", "(": "", ")": ""})
+
+# Catalog lookups are stable for the duration of a command, so they are kept
+# for a short while and dropped as soon as a change set is started.
+_CATALOG_CACHE_TTL = 60
+_catalog_cache: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+
+# Maximum number of entities accepted by a single BatchDescribeEntities request
+BATCH_DESCRIBE_LIMIT = 20
+
+T = TypeVar("T")
+
+# Clients are reused for the whole process (see get_client), so keep their
+# connections alive and retry throttled catalog requests with backoff.
+_BOTO_CONFIG = Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    user_agent_extra="awsmp",
+)
+
 
 class AmiProduct:
     def __init__(self, product_id: str):
         self.product_id: str = product_id
-        self.offer_id = get_public_offer_id(product_id)
+
+    @cached_property
+    def offer_id(self) -> str:
+        # only legal/support terms, pricing and release changes need the public offer
+        return get_public_offer_id(self.product_id)
 
     @staticmethod
     def create():
@@ -58,16 +104,21 @@ class AmiProduct:
         self, instance_types: IO, dimension_unit: Literal["Hrs", "Units"], free: bool
     ) -> ChangeSetReturnType:
         csvreader = csv.DictReader(instance_types, fieldnames=["name", "price_hourly", "price_annual"])
-        instance_type_pricing = [models.InstanceTypePricing(**line) for line in csvreader]  # type:ignore
+        existing_instance_types = _get_existing_instance_types(self.product_id)
 
         # AddInstanceTypes and AddDimensions does not need existing instance types information
         # Provide only new instance types which user wants to add
-        all_instance_types = {instance_type.name for instance_type in instance_type_pricing}
-        existing_instance_types = _get_existing_instance_types(self.product_id)
-        new_instance_types = list(all_instance_types - existing_instance_types)
+        # Keep the csv order (without duplicates) so the changeset is deterministic
+        instance_type_pricing: List[models.InstanceTypePricing] = []
+        new_instance_types: Dict[str, None] = {}
+        for line in csvreader:
+            pricing = models.InstanceTypePricing(**line)  # type:ignore
+            instance_type_pricing.append(pricing)
+            if pricing.name not in existing_instance_types:
+                new_instance_types[pricing.name] = None
 
         changeset = changesets.get_ami_listing_update_instance_type_changesets(
-            self.product_id, self.offer_id, instance_type_pricing, dimension_unit, new_instance_types, free
+            self.product_id, self.offer_id, instance_type_pricing, dimension_unit, list(new_instance_types), free
         )
         changeset_name = f"Product {self.product_id} instance type update"
         changeset_stringified = changesets.stringify_changeset_details(changeset)
@@ -95,12 +146,36 @@ class AmiProduct:
 
         return get_response(changeset_stringified, changeset_name)
 
-    def _get_product_title(self):
+    @cached_property
+    def product_title(self) -> str:
         return get_entity_details(self.product_id)["Description"]["ProductTitle"]
 
 
+def _catalog_cached(func: Callable[[str], T]) -> Callable[[str], T]:
+    @wraps(func)
+    def wrapper(entity_id: str) -> T:
+        key = (func.__name__, entity_id)
+        now = time.monotonic()
+        cached = _catalog_cache.get(key)
+        if cached is not None and now - cached[0] < _CATALOG_CACHE_TTL:
+            return cached[1]
+        value = func(entity_id)
+        _catalog_cache[key] = (now, value)
+        return value
+
+    return wrapper
+
+
+def invalidate_catalog_cache():
+    """
+    Forget all cached catalog lookups
+    """
+    _catalog_cache.clear()
+
+
+@lru_cache(maxsize=8)
 def get_client(service_name="marketplace-catalog", region_name="us-east-1"):
-    return boto3.client(service_name, region_name=region_name)
+    return boto3.client(service_name, region_name=region_name, config=_BOTO_CONFIG)
 
 
 def get_response(changeset_stringified: ChangeSetType, changeset_name: str) -> ChangeSetReturnType:
@@ -116,47 +191,62 @@ def get_response(changeset_stringified: ChangeSetType, changeset_name: str) -> C
         response = get_client().start_change_set(
             Catalog="AWSMarketplace",
             ChangeSet=changeset_stringified,
-            ChangeSetName=changeset_name,
+            ChangeSetName=changeset_name.translate(_CHANGESET_NAME_TABLE),
         )
     except ClientError as e:
         _raise_client_error(e)
 
+    # the change set may update entities which are cached
+    invalidate_catalog_cache()
     return response
 
 
+# AWS error code -> (log message, exception built from the AWS error message)
+_CLIENT_ERRORS: Dict[str, Tuple[str, Callable[[str], Exception]]] = {
+    "AccessDeniedException": (
+        "Profile does not have marketplace access. Please check your profile role or services.",
+        lambda error_msg: AccessDeniedException(service_name="marketplace"),
+    ),
+    "UnrecognizedClientException": (
+        "Profile is not configured correctly. Please check your credential with associated profile.",
+        lambda error_msg: UnrecognizedClientException(),
+    ),
+    "ResourceNotFoundException": (
+        "Product/Offer ID does not exist. Please check IDs and try again.",
+        lambda error_msg: ResourceNotFoundException(),
+    ),
+    "ValidationException": (
+        "Please check schema regex and request with fixed value.",
+        ValidationException,
+    ),
+}
+
+
 def _raise_client_error(exception: ClientError):
     exception_code, error_msg = exception.response["Error"]["Code"], exception.response["Error"]["Message"]
-    if exception_code == "AccessDeniedException":
-        logger.exception(f"Profile does not have marketplace access. Please check your profile role or services.")
-        raise AccessDeniedException(service_name="marketplace")
-    elif exception_code == "UnrecognizedClientException":
-        logger.exception(f"Profile is not configured correctly. Please check your credential with associated profile.")
-        raise UnrecognizedClientException from None
-    elif exception_code == "ResourceNotFoundException":
-        logger.exception(f"Product/Offer ID does not exist. Please check IDs and try again.")
-        raise ResourceNotFoundException from None
-    elif exception_code == "ValidationException":
-        logger.exception(f"Please check schema regex and request with fixed value.")
-        raise ValidationException(error_msg) from None
-    else:
+    if exception_code not in _CLIENT_ERRORS:
         logger.exception(error_msg)
         raise Exception
 
+    log_msg, build_exception = _CLIENT_ERRORS[exception_code]
+    logger.exception(log_msg)
+    raise build_exception(error_msg) from None
+
 
-def list_entities(entity_type: str) -> dict[str, dict[str, str]]:
+def list_entities(entity_type: str) -> Iterator[Dict[str, str]]:
     client = get_client()
-    entities = dict()
     paginator = client.get_paginator("list_entities")
     page_iterator = paginator.paginate(
         Catalog="AWSMarketplace",
         EntityType=entity_type,
+        # 50 is the maximum page size accepted by the ListEntities API
+        PaginationConfig={"PageSize": 50},
     )
     for page in page_iterator:
-        for e in page["EntitySummaryList"]:
-            entities[e["EntityId"]] = e
-    return entities
+        yield from page["EntitySummaryList"]
 
 
+@_catalog_cached
 def get_entity_details(entity_id: str) -> Dict:
     client = get_client()
     try:
@@ -164,9 +254,13 @@ def get_entity_details(entity_id: str) -> Dict:
     except ClientError as error:
         _raise_client_error(error)
 
-    return json.loads(e["Details"])
+    # DetailsDocument is already parsed by botocore, Details is the same document as a JSON string.
+    # The document is shared between callers through the cache, so it must not be modified.
+    details = e.get("DetailsDocument")
+    return details if details is not None else json_loads(e["Details"])
 
 
+@_catalog_cached
 def get_public_offer_id(entity_id: str):
     client = get_client()
     e = client.list_entities(
@@ -182,6 +276,8 @@ def get_public_offer_id(entity_id: str):
                 "Targeting": {"ValueList": ["None"]},
             }
         },
+        # a product has a single public offer, only the first match is used
+        MaxResults=1,
     )
     if not e["EntitySummaryList"]:
         raise ResourceNotFoundException(f"\n\nOffer with entity-id {entity_id} not found.\n")
@@ -190,42 +286,57 @@ def get_public_offer_id(entity_id: str):
 
 
 def get_entity_versions(entity_id: str) -> List[dict[str, str]]:
-    details = get_entity_details(entity_id)
-    if "Versions" not in details.keys():
-        return []
-    return sorted(details["Versions"], key=lambda x: x["CreationDate"])
-
+    # sort a copy, the cached details must not be modified
+    return sorted(get_entity_details(entity_id).get("Versions") or [], key=itemgetter("CreationDate"))
 
-def _get_ratecard_info(changeset: Dict, idx: int, instance_types: List[str]) -> List[Dict]:
-    ratecard = changeset[3]["Details"]["Terms"][idx]["RateCards"][0]["RateCard"]
-    return [r for r in ratecard if r["DimensionKey"] in instance_types]
 
-
-def _get_existing_instance_types(product_id: str):
+def batch_get_entity_versions(entity_ids: List[str]) -> Dict[str, List[dict[str, str]]]:
+    client = get_client()
+    # BatchDescribeEntities is not available in older botocore releases
+    if not hasattr(client, "batch_describe_entities"):
+        return {entity_id: get_entity_versions(entity_id) for entity_id in entity_ids}
+
+    versions: Dict[str, List[dict[str, str]]] = {}
+    for i in range(0, len(entity_ids), BATCH_DESCRIBE_LIMIT):
+        try:
+            e = client.batch_describe_entities(
+                EntityRequestList=[
+                    {"Catalog": "AWSMarketplace", "EntityId": entity_id}
+                    for entity_id in entity_ids[i : i + BATCH_DESCRIBE_LIMIT]
+                ]
+            )
+        except ClientError as error:
+            _raise_client_error(error)
+
+        for entity_id, entity in e["EntityDetails"].items():
+            versions[entity_id] = sorted(entity["DetailsDocument"].get("Versions", []), key=itemgetter("CreationDate"))
+        # describe failed entities one by one so their error is raised as usual
+        for entity_id in e["Errors"]:
+            versions[entity_id] = get_entity_versions(entity_id)
+
+    return versions
+
+
+def _get_existing_instance_types(product_id: str) -> FrozenSet[str]:
     entity = get_entity_details(product_id)
     # New created product does not have existing instance types
-    existing_instance_types = set()
-    if "Dimensions" in entity:
-        existing_instance_types = {t["Name"] for t in entity["Dimensions"]}
-    return existing_instance_types
+    return frozenset(t["Name"] for t in entity.get("Dimensions", []))
 
 
 def _filter_instance_types(product_id: str, changeset):
     existing_instance_types = _get_existing_instance_types(product_id)
-    pricing_instance_types = {
-        t["DimensionKey"] for t in changeset[3]["Details"]["Terms"][0]["RateCards"][0]["RateCard"]
-    }
+    terms = changeset[3]["Details"]["Terms"]
+    pricing_instance_types = {t["DimensionKey"] for t in terms[0]["RateCards"][0]["RateCard"]}
 
     if missing_instance_types := existing_instance_types.difference(pricing_instance_types):
         logger.exception(f"Instance types does not match with original listing.")
         raise MissingInstanceTypeError(missing_instance_types)
-    intersect = list(pricing_instance_types.intersection(existing_instance_types))
 
-    # idx 0 is hourly pricing, and 1 is annual
-    for idx in {0, 1}:
-        changeset[3]["Details"]["Terms"][idx]["RateCards"][0]["RateCard"] = _get_ratecard_info(
-            changeset, idx, intersect
-        )
+    # every existing instance type is priced at this point, so the existing set is the
+    # intersection; drop priced types the product doesn't have from hourly and annual terms
+    for term in terms:
+        rate_card = term["RateCards"][0]
+        rate_card["RateCard"] = [r for r in rate_card["RateCard"] if r["DimensionKey"] in existing_instance_types]
     return changeset
 
 
@@ -239,7 +350,8 @@ def offer_create(
     pricing: IO,
 ) -> ChangeSetReturnType:
     csvreader = csv.DictReader(pricing, fieldnames=["name", "price_hourly", "price_annual"])
-    instance_type_pricing = [models.InstanceTypePricing(**line) for line in csvreader]  # type:ignore
+    # rows are consumed once while building the pricing terms, no need to keep a list around
+    instance_type_pricing = (models.InstanceTypePricing(**line) for line in csvreader)  # type:ignore
 
     changeset_list = changesets.get_changesets(
         product_id,
@@ -256,7 +368,7 @@ def offer_create(
 
     client = get_client()
 
-    changeset_name = f'{f"create private offer for {product_id}: {offer_name}"[:95]}...'.replace(",", "_")
+    changeset_name = f'{f"create private offer for {product_id}: {offer_name}"[:95]}...'
 
     return get_response(changeset_stringified, changeset_name)
 
@@ -266,7 +378,7 @@ def create_offer_name(product_id: str, buyer_accounts: List[str], with_support:
 
     account_part = ",".join(buyer_accounts)
     if len(account_part) > 50:
-        account_part = f"{account_part[:47]}..."
+        account_part = f"{account_part:.47}..."
     title_part = details["Description"]["ProductTitle"]
     support_part = " wSupport" if with_support else ""
 
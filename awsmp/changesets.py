@@ -1,17 +1,20 @@
 import datetime
 import json
-from decimal import Decimal
-from typing import Any, Dict, List, Literal, Optional, TypedDict, Union
-
-import boto3
-from pydantic import BaseModel, Field, HttpUrl, conlist, field_validator
-from typing_extensions import NotRequired
-
-from awsmp.constants import CATEGORIES
+from operator import attrgetter
+from typing import Dict, Iterable, List, Literal, Optional
 
 from . import models
 from .types import ChangeSetType, UpdateDimensionChange
 
+# Reference to the offer created by a CreateOffer change in the same changeset,
+# default offer_id for combined calls such as private offer creation
+_CREATE_OFFER_REF = "$CreateOfferChange.Entity.Identifier"
+
+# Dimension types shared by every metered instance type, only ever serialised
+_METERED_TYPES: List[Literal["Metered"]] = ["Metered"]
+
+_get_price_fields = attrgetter("name", "price_hourly", "price_annual")
+
 
 def _changeset_create_offer(product_id: str, offer_name: str) -> ChangeSetType:
     return {
@@ -35,7 +38,7 @@ def _changeset_create_ami_product() -> ChangeSetType:
 
 def _changeset_update_information(
     offer_name: str,
-    offer_id: str = "$CreateOfferChange.Entity.Identifier",
+    offer_id: str = _CREATE_OFFER_REF,
 ) -> ChangeSetType:
     return {
         "ChangeType": "UpdateInformation",
@@ -50,41 +53,24 @@ def _changeset_update_information(
 def _changeset_update_targeting(buyer_accounts: List[str]) -> ChangeSetType:
     return {
         "ChangeType": "UpdateTargeting",
-        "Entity": {"Type": "Offer@1.0", "Identifier": "$CreateOfferChange.Entity.Identifier"},
+        "Entity": {"Type": "Offer@1.0", "Identifier": _CREATE_OFFER_REF},
         "Details": {"PositiveTargeting": {"BuyerAccounts": buyer_accounts}},
     }
 
 
 def _changeset_update_pricing_terms(
-    instance_type_pricing: List[models.InstanceTypePricing],
-    offer_id: Optional[str] = None,
+    instance_type_pricing: Iterable[models.InstanceTypePricing],
+    offer_id: str = _CREATE_OFFER_REF,
     free: bool = False,
 ) -> ChangeSetType:
-    rate_cards_hourly: List[Dict[str, str]] = []
-    rate_cards_annual: List[Dict[str, str]] = []
-
-    # set offer_id for combined call for private offer creation
-    if not offer_id:
-        offer_id = "$CreateOfferChange.Entity.Identifier"
-
-    # generate the rate cards
-    for instance_type_price in instance_type_pricing:
-        # Free public listing is 0.00 which is false
-        if instance_type_price.price_hourly or free:
-            rate_cards_hourly.append(
-                {
-                    "DimensionKey": instance_type_price.name,
-                    "Price": str(instance_type_price.price_hourly),
-                }
-            )
-
-        if instance_type_price.price_annual:
-            rate_cards_annual.append(
-                {
-                    "DimensionKey": instance_type_price.name,
-                    "Price": str(instance_type_price.price_annual),
-                }
-            )
+    # generate the rate cards, read the pricing once as it may be a one-shot iterator
+    prices = list(map(_get_price_fields, instance_type_pricing))
+    # fixed-point format, Decimal str() can produce exponents such as 1E+2
+    # Free public listing is 0.00 which is false
+    rate_cards_hourly = [
+        {"DimensionKey": name, "Price": format(hourly, "f")} for name, hourly, _ in prices if hourly or free
+    ]
+    rate_cards_annual = [{"DimensionKey": name, "Price": format(annual, "f")} for name, _, annual in prices if annual]
 
     # hourly rate card are required for both public/private offer
     terms = [
@@ -130,19 +116,17 @@ def _changeset_update_availability(days_from_today: int) -> ChangeSetType:
         "ChangeType": "UpdateAvailability",
         "Entity": {
             "Type": "Offer@1.0",
-            "Identifier": "$CreateOfferChange.Entity.Identifier",
+            "Identifier": _CREATE_OFFER_REF,
         },
-        "Details": {"AvailabilityEndDate": end.strftime("%Y-%m-%d")},
+        "Details": {"AvailabilityEndDate": end.isoformat()},
     }
 
 
-def _changeset_update_legal_terms(offer_id: Optional[str] = None, eula_url: Optional[str] = None) -> ChangeSetType:
+def _changeset_update_legal_terms(offer_id: str = _CREATE_OFFER_REF, eula_url: Optional[str] = None) -> ChangeSetType:
     if eula_url:
         eula_document = {"Type": "CustomEula", "Url": eula_url}
     else:
         eula_document = {"Type": "StandardEula", "Version": "2022-07-14"}
-    if not offer_id:
-        offer_id = "$CreateOfferChange.Entity.Identifier"
 
     return {
         "ChangeType": "UpdateLegalTerms",
@@ -161,14 +145,12 @@ def _changeset_update_legal_terms(offer_id: Optional[str] = None, eula_url: Opti
 def _changeset_update_validity_terms(days: int) -> ChangeSetType:
     return {
         "ChangeType": "UpdateValidityTerms",
-        "Entity": {"Type": "Offer@1.0", "Identifier": "$CreateOfferChange.Entity.Identifier"},
+        "Entity": {"Type": "Offer@1.0", "Identifier": _CREATE_OFFER_REF},
         "Details": {"Terms": [{"Type": "ValidityTerm", "AgreementDuration": f"P{days}D"}]},
     }
 
 
-def _changeset_release_offer(offer_id: Optional[str] = None) -> ChangeSetType:
-    if not offer_id:
-        offer_id = "$CreateOfferChange.Entity.Identifier"
+def _changeset_release_offer(offer_id: str = _CREATE_OFFER_REF) -> ChangeSetType:
     return {
         "ChangeType": "ReleaseOffer",
         "Entity": {
@@ -179,9 +161,7 @@ def _changeset_release_offer(offer_id: Optional[str] = None) -> ChangeSetType:
     }
 
 
-def _changeset_update_support_terms(refund_policy: str, offer_id: Optional[str] = None) -> ChangeSetType:
-    if not offer_id:
-        offer_id = "$CreateOfferChange.Entity.Identifier"
+def _changeset_update_support_terms(refund_policy: str, offer_id: str = _CREATE_OFFER_REF) -> ChangeSetType:
     return {
         "ChangeType": "UpdateSupportTerms",
         "Entity": {
@@ -201,7 +181,7 @@ def _changeset_update_support_terms(refund_policy: str, offer_id: Optional[str]
 
 def _changeset_update_ami_product_description(product_id: str, desc: Dict) -> ChangeSetType:
     # description data format checking
-    m = models.AmiProduct(**desc)
+    m = models.AmiProduct.model_validate(desc)
 
     # return changeset
     return {
@@ -238,10 +218,7 @@ def _changeset_update_ami_product_instance_type(product_id: str, new_instance_ty
     }
 
 
-def _changeset_update_ami_product_region(product_id: str, region_config: Dict) -> ChangeSetType:
-    # config file format checking available regions
-    regions = models.Region(**region_config)
-
+def _changeset_update_ami_product_region(product_id: str, regions: models.Region) -> ChangeSetType:
     # return changeset
     return {
         "ChangeType": "AddRegions",
@@ -253,8 +230,7 @@ def _changeset_update_ami_product_region(product_id: str, region_config: Dict) -
     }
 
 
-def _changeset_update_ami_product_future_region(product_id: str, region_config: Dict) -> ChangeSetType:
-    region = models.Region(**region_config)
+def _changeset_update_ami_product_future_region(product_id: str, region: models.Region) -> ChangeSetType:
     # return changeset
     return {
         "ChangeType": "UpdateFutureRegionSupport",
@@ -271,9 +247,7 @@ def _build_metered_instance_unit(instance_type: str, dimension_unit: Literal["Hr
         "Description": instance_type,
         "Key": instance_type,
         "Name": instance_type,
-        "Types": [
-            "Metered",
-        ],
+        "Types": _METERED_TYPES,
         "Unit": dimension_unit,
     }
 
@@ -297,7 +271,7 @@ def _changeset_update_ami_product_dimension(
 
 
 def _changeset_update_ami_product_version(product_id: str, version_config: Dict) -> ChangeSetType:
-    version = models.AmiVersion(**version_config)
+    version = models.AmiVersion.model_validate(version_config)
     # return changeset
     return {
         "ChangeType": "AddDeliveryOptions",
@@ -353,12 +327,12 @@ def _changeset_release_ami_product(product_id: str) -> ChangeSetType:
 
 def stringify_changeset_details(changesets: List[ChangeSetType]):
     for change_type in changesets:
+        details = change_type["Details"]
+        # Details already stringified by an earlier call
+        if isinstance(details, str):
+            continue
         # Only stringify details section if it is not empty
-        if change_type["Details"] != "{}":
-            string_details = json.dumps(change_type["Details"])
-            change_type["Details"] = string_details
-        else:
-            pass
+        change_type["Details"] = json.dumps(details) if details else "{}"
 
     return changesets
 
@@ -367,7 +341,7 @@ def get_changesets(
     product_id: str,
     offer_name: str,
     buyer_accounts: List[str],
-    instance_type_pricing: List[models.InstanceTypePricing],
+    instance_type_pricing: Iterable[models.InstanceTypePricing],
     available_for_days: int,
     valid_for_days: int,
     eula_url: Optional[str],
@@ -413,9 +387,11 @@ def get_ami_listing_update_instance_type_changesets(
 
 
 def get_ami_listing_update_region_changesets(product_id: str, region_config: Dict) -> List[ChangeSetType]:
+    # config file format checking available regions, validated once for both changes
+    region = models.Region.model_validate(region_config)
     return [
-        _changeset_update_ami_product_region(product_id, region_config),
-        _changeset_update_ami_product_future_region(product_id, region_config),
+        _changeset_update_ami_product_region(product_id, region),
+        _changeset_update_ami_product_future_region(product_id, region),
     ]
 
 
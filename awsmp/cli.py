@@ -3,23 +3,34 @@
 import csv
 import json
 import logging
-import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from operator import itemgetter
 from typing import Dict, List, TextIO
 
 import click
-import prettytable
-import yaml
-from botocore.exceptions import ClientError
 
-from . import _driver
 from .errors import (
     AccessDeniedException,
     NoProductIdProvidedException,
     YamlMissingKeyException,
 )
+from .types import ChangeSetReturnType
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on concurrent catalog API calls, throttling is absorbed by adaptive retries
+_MAX_WORKERS = 16
+
+_CHANGESET_URL = "https://aws.amazon.com/marketplace/management/requests/"
+
+_ENTITY_TYPE_CHOICES = click.Choice(("Offer", "AmiProduct"))
+_VISIBILITY_CHOICES = click.Choice(("Public", "Restricted", "Limited"))
+_DIMENSION_UNIT_CHOICES = click.Choice(("Hrs", "Units"))
+_YES_NO_CHOICES = click.Choice(("Y", "N"))
+_ARCH_CHOICES = click.Choice(("x86_64", "arm64", "i386"))
+_VIRT_CHOICES = click.Choice(("hvm", "paravirtual"))
+
 
 @click.group()
 def cli():
@@ -51,25 +62,35 @@ def inspect():
 
 
 @inspect.command("entity-list")
-@click.argument("entity-type", type=click.Choice(["Offer", "AmiProduct"]))
-@click.option("--filter-visibility", multiple=True, type=click.Choice(["Public", "Restricted", "Limited"]))
+@click.argument("entity-type", type=_ENTITY_TYPE_CHOICES)
+@click.option("--filter-visibility", multiple=True, type=_VISIBILITY_CHOICES)
 def entity_list(entity_type, filter_visibility):
     """
     List available entities. Currently supported are entities of type "Offer"
     and "AmiProduct".
     """
-    entity_list = _driver.list_entities(entity_type)
+    import prettytable
+
+    from . import _driver
+
+    rows = [
+        [entity["EntityId"], entity["Name"], entity["Visibility"], entity["LastModifiedDate"]]
+        for entity in _driver.list_entities(entity_type)
+        if not filter_visibility or entity["Visibility"] in filter_visibility
+    ]
+    # LastModifiedDate is ISO 8601, so sorting the strings sorts by date
+    rows.sort(key=itemgetter(3))
     t = prettytable.PrettyTable()
     t.field_names = ["entity-id", "name", "visibility", "last-changed"]
-    for _, entity in entity_list.items():
-        if not filter_visibility or entity["Visibility"] in filter_visibility:
-            t.add_row([entity["EntityId"], entity["Name"], entity["Visibility"], entity["LastModifiedDate"]])
-    print(t.get_string(sortby="last-changed"))
+    t.add_rows(rows)
+    print(t.get_string())
 
 
 @inspect.command("entity-show", help="Show a specific entity")
 @click.argument("entity-id")
 def entity_show(entity_id):
+    from . import _driver
+
     details = _driver.get_entity_details(entity_id)
     print(json.dumps(details, indent=2))
 
@@ -79,13 +100,22 @@ def entity_versions_count():
     """
     List each marketplace entry with it's number of versions, sorted by number of versions
     """
-    entity_dict = _driver.list_entities("AmiProduct")
-    versions = [
-        (entity_id, len(_driver.get_entity_versions(entity_id)), entity_dict[entity_id]["Name"])
-        for entity_id in entity_dict.keys()
-    ]
+    from . import _driver
 
-    for version in sorted(versions, key=lambda x: x[1]):
+    entities = list(_driver.list_entities("AmiProduct"))
+    entity_ids = [entity["EntityId"] for entity in entities]
+    batches = [
+        entity_ids[i : i + _driver.BATCH_DESCRIBE_LIMIT]
+        for i in range(0, len(entity_ids), _driver.BATCH_DESCRIBE_LIMIT)
+    ]
+    # one describe call per batch of entities, run them concurrently instead of back to back
+    entity_versions: Dict[str, List] = {}
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+        for batch_versions in executor.map(_driver.batch_get_entity_versions, batches):
+            entity_versions.update(batch_versions)
+    versions = [(entity["EntityId"], len(entity_versions[entity["EntityId"]]), entity["Name"]) for entity in entities]
+
+    for version in sorted(versions, key=itemgetter(1)):
         print(f"{version[0]} - {version[1]} - {version[2]}")
 
 
@@ -95,12 +125,16 @@ def entity_versions_list(entity_id):
     """
     List all versions for a provided entity id.
     """
+    import prettytable
+
+    from . import _driver
+
+    # versions are returned sorted by CreationDate
     versions = _driver.get_entity_versions(entity_id)
     t = prettytable.PrettyTable()
     t.field_names = ["CreationDate", "Id", "version title"]
-    for v in versions:
-        t.add_row([v["CreationDate"], v["Id"], v["VersionTitle"]])
-    print(t.get_string(sortby="CreationDate"))
+    t.add_rows([[v["CreationDate"], v["Id"], v["VersionTitle"]] for v in versions])
+    print(t.get_string())
 
 
 @private_offer.command("create")
@@ -148,6 +182,8 @@ def offer_create(
     The --eula-url option can be left blank if the default aws EULA is acceptable.
         The value can also be set via the `AWSMP_EULA_URL` environment variable
     """
+    from . import _driver
+
     eula_url = None if eula_url == "" else eula_url
     if not buyer_accounts:
         buyers = click.prompt("Please enter all buyer accounts separated by a comma")
@@ -155,8 +191,7 @@ def offer_create(
 
     offer_name = _driver.create_offer_name(product_id, buyer_accounts, with_support, customer_name)
 
-    click.echo(f"> {offer_name}")
-    confirm = click.confirm("Is the offer name listed above correct?")
+    confirm = click.confirm(f"> {offer_name}\nIs the offer name listed above correct?")
     if not confirm:
         offer_name = click.prompt("Please enter the offer name in full")
 
@@ -164,8 +199,7 @@ def offer_create(
         product_id, buyer_accounts, available_for_days, valid_for_days, offer_name, eula_url, pricing
     )
 
-    print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    _print_changeset(response)
 
 
 @cli.command("pricing-template", help="Generate pricing template for public/private offers")
@@ -176,38 +210,30 @@ def offer_pricing_template(offer_id, pricing, free):
     """
     Create a pricing template (.csv file) based on a given offer
     """
-    client = _driver.get_client()
-    e = client.describe_entity(Catalog="AWSMarketplace", EntityId=offer_id)
-    details = json.loads(e["Details"])
-
-    prices_hourly = {}
-    prices_annual = {}
-    for term in details["Terms"]:
-        if term["Type"] not in ["UsageBasedPricingTerm", "ConfigurableUpfrontPricingTerm"]:
-            continue
-        for rate_card in term["RateCards"]:
-            for d in rate_card["RateCard"]:
-                if term["Type"] == "UsageBasedPricingTerm":
-                    # hourly
-                    prices_hourly[d["DimensionKey"]] = d["Price"]
-                elif term["Type"] == "ConfigurableUpfrontPricingTerm":
-                    # annual
-                    prices_annual[d["DimensionKey"]] = d["Price"]
-                else:
-                    raise Exception(f'Unknown terms type {term["type"]}')
-
-    # both should have the same keys so calculate the symmetric difference
+    from . import _driver
+
+    details = _driver.get_entity_details(offer_id)
+
+    # hourly
+    prices_hourly = _rate_card_prices(details["Terms"], "UsageBasedPricingTerm")
+    # annual
+    prices_annual = _rate_card_prices(details["Terms"], "ConfigurableUpfrontPricingTerm")
+
+    # both should have the same keys, the symmetric difference is only needed for the error
     # this should never happen given that we get the data from an available offer
     # free listing can be skipped since it doesn't have annual pricing
     if not free:
-        if prices_hourly.keys() ^ prices_annual.keys():
-            raise Exception("instance type dimensions are not identical in hourly and annual prices")
+        if prices_hourly.keys() != prices_annual.keys():
+            mismatched = ", ".join(sorted(prices_hourly.keys() ^ prices_annual.keys()))
+            raise Exception(f"instance type dimensions are not identical in hourly and annual prices: {mismatched}")
     else:
         prices_annual = prices_hourly
 
     csvwriter = csv.writer(pricing)
-    for instance_type in sorted(prices_hourly.keys()):
-        csvwriter.writerow([instance_type, prices_hourly[instance_type], prices_annual[instance_type]])
+    csvwriter.writerows(
+        (instance_type, prices_hourly[instance_type], prices_annual[instance_type])
+        for instance_type in sorted(prices_hourly)
+    )
 
 
 @public_offer.command("create")
@@ -215,10 +241,11 @@ def ami_product_create():
     """
     Create a new AMI product listing
     """
+    from . import _driver
+
     response = _driver.AmiProduct.create()
 
-    print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    _print_changeset(response)
 
 
 @public_offer.command("update-description")
@@ -228,60 +255,69 @@ def ami_product_update_description(product_id, config):
     """
     Update AMI product description
     """
+    from . import _driver
+
     # Load yaml file
     desc = _load_configuration(config, ["description"])["description"]
     response = _driver.AmiProduct(product_id=product_id).update_description(desc)
-    print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    _print_changeset(response)
 
 
 @public_offer.command("update-instance-type")
 @click.option("--product-id", required=True, prompt=True)
 @click.option("--instance-type-file", type=click.File("r"), required=True, prompt=True)
-@click.option("--dimension-unit", required=True, prompt=True, type=click.Choice(["Hrs", "Units"]))
-@click.option("--free", required=True, prompt=True, type=click.Choice(["Y", "N"]))
+@click.option("--dimension-unit", required=True, prompt=True, type=_DIMENSION_UNIT_CHOICES)
+@click.option("--free", required=True, prompt=True, type=_YES_NO_CHOICES)
 def ami_product_update_instance_type(product_id, instance_type_file, dimension_unit, free):
     """
     Update AMI product instance type
     """
+    from . import _driver
+
     free = True if free == "Y" else False
     product = _driver.AmiProduct(product_id=product_id)
     response = product.update_instance_types(instance_type_file, dimension_unit, free)
-    print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    _print_changeset(response)
 
 
 @public_offer.command("instance-type-template")
-@click.option("--arch", required=True, prompt=True, type=click.Choice(["x86_64", "arm64", "i386"]))
-@click.option("--virt", required=True, prompt=True, type=click.Choice(["hvm", "paravirtual"]))
+@click.option("--arch", required=True, prompt=True, type=_ARCH_CHOICES)
+@click.option("--virt", required=True, prompt=True, type=_VIRT_CHOICES)
 def ami_product_instance_type_template(arch, virt):
     """
     Generate AMI product instance type template
     """
-    # Load yaml file
+    from botocore.exceptions import ClientError
+
+    from . import _driver
+
     client = _driver.get_client(service_name="ec2")
-    try:
-        e = client.get_instance_types_from_instance_requirements(
-            ArchitectureTypes=[arch],
-            VirtualizationTypes=[virt],
-            InstanceRequirements={
-                "VCpuCount": {
-                    "Min": 0,
-                },
-                "MemoryMiB": {
-                    "Min": 0,
-                },
+    paginator = client.get_paginator("get_instance_types_from_instance_requirements")
+    pages = paginator.paginate(
+        ArchitectureTypes=[arch],
+        VirtualizationTypes=[virt],
+        InstanceRequirements={
+            "VCpuCount": {
+                "Min": 0,
+            },
+            "MemoryMiB": {
+                "Min": 0,
             },
-        )
+        },
+    )
+    try:
+        # fetch the first page before creating the file so a denied request leaves nothing behind
+        page_iterator = iter(pages)
+        first_page = next(page_iterator)
     except ClientError:
         logger.exception("Profile does not have EC2 service access. Check your profile role or services.")
         raise AccessDeniedException(service_name="ec2")
 
-    available_instances = [i["InstanceType"] for i in e["InstanceTypes"]]
-    with open("instance_type.csv", "w") as f:
+    with open("instance_type.csv", "w", newline="") as f:
         csvwriter = csv.writer(f)
-        for instance in available_instances:
-            csvwriter.writerow([instance, 0.00, 0.00])
+        # write each page as it arrives instead of collecting all instance types first
+        for page in chain([first_page], page_iterator):
+            csvwriter.writerows((i["InstanceType"], 0.00, 0.00) for i in page["InstanceTypes"])
     print(f"Available instance types are exported in instance_type.csv file.")
 
 
@@ -292,13 +328,14 @@ def ami_product_update_regions(product_id, config):
     """
     Update AMI product region
     """
+    from . import _driver
+
     # Load yaml file
     region_config = _load_configuration(config, ["region"])["region"]
 
     product = _driver.AmiProduct(product_id=product_id)
     response = product.update_regions(region_config)
-    print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    _print_changeset(response)
 
 
 @public_offer.command("update-version")
@@ -308,13 +345,14 @@ def ami_product_update_version(product_id, config):
     """
     Update AMI product version
     """
+    from . import _driver
+
     # Load yaml file
     version_config = _load_configuration(config, ["version"])["version"]
 
     product = _driver.AmiProduct(product_id=product_id)
     response = product.update_version(version_config)
-    print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    _print_changeset(response)
 
 
 @public_offer.command("update-legal-terms")
@@ -324,13 +362,14 @@ def ami_product_update_legal_terms(product_id, config):
     """
     Update AMI product legal terms
     """
+    from . import _driver
+
     # Load yaml file
     eula_url = _load_configuration(config, ["eula_url"])["eula_url"]
 
     product = _driver.AmiProduct(product_id=product_id)
     response = product.update_legal_terms(eula_url)
-    print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    _print_changeset(response)
 
 
 @public_offer.command("update-support-terms")
@@ -340,13 +379,14 @@ def ami_product_update_support_terms(product_id, config):
     """
     Update AMI product support terms
     """
+    from . import _driver
+
     # Load yaml file
     refund_policy = _load_configuration(config, ["refund_policy"])["refund_policy"]
 
     product = _driver.AmiProduct(product_id=product_id)
     response = product.update_support_terms(refund_policy)
-    print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    _print_changeset(response)
 
 
 @public_offer.command("release")
@@ -355,28 +395,58 @@ def ami_product_release(product_id):
     """
     Publish AMI product as Limited
     """
+    from . import _driver
 
     product = _driver.AmiProduct(product_id=product_id)
     response = product.release()
+    _print_changeset(response)
+
+
+def _print_changeset(response: ChangeSetReturnType) -> None:
+    """
+    Print the id of a created change set and the link to follow its progress
+
+    :param ChangeSetReturnType response: Response of the StartChangeSet request
+    """
     print(f'ChangeSet created (ID: {response["ChangeSetId"]})')
-    print(f'https://aws.amazon.com/marketplace/management/requests/{response["ChangeSetId"]}')
+    print(f'{_CHANGESET_URL}{response["ChangeSetId"]}')
 
 
-def _load_configuration(config_path: TextIO, required_fields: List[str]) -> Dict:
+def _rate_card_prices(terms: List[Dict], term_type: str) -> Dict[str, str]:
+    """
+    Collect the price of every dimension in the rate cards of the given term type
+
+    :param List[Dict] terms: Terms of an offer entity
+    :param str term_type: Type of the pricing term to collect
+    :return: dictionary of dimension key to price
+    :rtype: Dict[str, str]
+    """
+    return {
+        d["DimensionKey"]: d["Price"]
+        for term in terms
+        if term["Type"] == term_type
+        for rate_card in term["RateCards"]
+        for d in rate_card["RateCard"]
+    }
+
+
+def _load_configuration(config_file: TextIO, required_fields: List[str]) -> Dict:
     """
     Check if keys exist in config file before creating changeset and return config dict
 
-    :param TextIO config_path: File path for configuration yaml file
+    :param TextIO config_file: Opened configuration yaml file
     :param: List of :str: required_fields: List of required keys to request
     :return: dictionary of configuration
     :rtype: Dict
     """
-    with open(config_path.name, "r") as f:
-        config = yaml.safe_load(f)
-        missing_keys = [key for key in required_fields if key not in config]
-        if missing_keys:
-            logger.exception(f"{missing_keys} are missed in config file.")
-            raise YamlMissingKeyException(missing_keys=missing_keys)
+    import yaml
+
+    # use the libyaml backed loader when PyYAML was built with it
+    config = yaml.load(config_file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    missing_keys = [key for key in required_fields if key not in config]
+    if missing_keys:
+        logger.error(f"{missing_keys} are missed in config file.")
+        raise YamlMissingKeyException(missing_keys=missing_keys)
 
     return config
 
@@ -1,11 +1,35 @@
-from typing import List
+from typing import Iterable, List
+
+_RESOURCE_NOT_FOUND_MESSAGE = """
+
+
+Product/Offer ID does not exist. Please check your those information and try again.
+Product/Offer ID can be found in Home > Requests > Create new AMI Product from marketplace management portal https://aws.amazon.com/marketplace/management/requests/.
+"""
+
+_UNRECOGNIZED_CLIENT_MESSAGE = """
+
+
+This profile is not configured correctly.
+Please check your credential with associated profile.
+"""
+
+_NO_PRODUCT_ID_PROVIDED_MESSAGE = """
+
+
+No product ids are provided. Please pass at least one product id for using this function.
+"""
 
 
 class MissingInstanceTypeError(Exception):
-    def __init__(self, instance_types: List[str]):
-        formatted_types = "\n".join(instance_types)
-        message = f"The following instance types are missing from your pricing csv:\n{formatted_types}"
-        super().__init__(message)
+    def __init__(self, instance_types: Iterable[str]):
+        self.instance_types = tuple(instance_types)
+        super().__init__(self.instance_types)
+
+    def __str__(self) -> str:
+        # the message is only built when the error is actually displayed
+        formatted_types = "\n".join(sorted(self.instance_types))
+        return f"The following instance types are missing from your pricing csv:\n{formatted_types}"
 
 
 class AWSException(Exception):
@@ -28,24 +52,12 @@ class ResourceNotFoundException(AWSException):
         if args:
             super().__init__(*args)
         else:
-            message = """
-
-
-Product/Offer ID does not exist. Please check your those information and try again.
-Product/Offer ID can be found in Home > Requests > Create new AMI Product from marketplace management portal https://aws.amazon.com/marketplace/management/requests/.
-"""
-            super().__init__(message)
+            super().__init__(_RESOURCE_NOT_FOUND_MESSAGE)
 
 
 class UnrecognizedClientException(AWSException):
     def __init__(self):
-        message = """
-
-
-This profile is not configured correctly.
-Please check your credential with associated profile.
-"""
-        super().__init__(message)
+        super().__init__(_UNRECOGNIZED_CLIENT_MESSAGE)
 
 
 class ValidationException(AWSException):
@@ -71,9 +83,4 @@ Config file does not have key {*missing_keys,}. Please check the file and reques
 
 class NoProductIdProvidedException(Exception):
     def __init__(self):
-        message = f"""
-
-
-No product ids are provided. Please pass at least one product id for using this function.
-"""
-        super().__init__(message)
+        super().__init__(_NO_PRODUCT_ID_PROVIDED_MESSAGE)
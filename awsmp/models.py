@@ -2,12 +2,22 @@ from decimal import Decimal
 from typing import Dict, List, Literal, Optional, TypedDict
 
 import boto3
-from pydantic import BaseModel, Field, HttpUrl, conlist, constr, field_validator
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    HttpUrl,
+    conlist,
+    constr,
+    field_validator,
+)
 
 from awsmp.constants import CATEGORIES
 
 
 class InstanceTypePricing(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     name: str
     price_hourly: Decimal = Field(ge=0.0, decimal_places=4)
     price_annual: Decimal = Field(ge=0.0, decimal_places=4)
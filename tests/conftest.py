@@ -0,0 +1,8 @@
+import pytest
+
+from awsmp import _driver
+
+
+@pytest.fixture(autouse=True)
+def clear_catalog_cache():
+    _driver.invalidate_catalog_cache()
@@ -1,6 +1,10 @@
+import datetime
+from decimal import Decimal
+from unittest.mock import patch
+
 import pytest
 
-from awsmp import changesets
+from awsmp import changesets, models
 
 
 @pytest.mark.parametrize(
@@ -10,3 +14,36 @@ from awsmp import changesets
 def test_changeset_update_legal_terms_eula_options(eula_url, expected):
     result = changesets._changeset_update_legal_terms(eula_url=eula_url)
     result["Details"]["Terms"][0] == expected  # type: ignore
+
+
+@patch("awsmp.changesets.datetime")
+def test_changeset_update_availability(mock_datetime):
+    mock_datetime.date.today.return_value = datetime.date(2024, 2, 20)
+    mock_datetime.timedelta = datetime.timedelta
+    result = changesets._changeset_update_availability(10)
+    assert result["Details"] == {"AvailabilityEndDate": "2024-03-01"}
+
+
+def test_stringify_changeset_details():
+    changeset = [
+        changesets._changeset_create_ami_product(),
+        changesets._changeset_release_ami_product("prod-id"),
+        changesets._changeset_update_validity_terms(30),
+    ]
+    result = changesets.stringify_changeset_details(changesets.stringify_changeset_details(changeset))
+    assert [change["Details"] for change in result] == [
+        "{}",
+        "{}",
+        '{"Terms": [{"Type": "ValidityTerm", "AgreementDuration": "P30D"}]}',
+    ]
+
+
+def test_changeset_update_pricing_terms_fixed_point_prices():
+    pricing = [models.InstanceTypePricing(name="t2.nano", price_hourly=Decimal("1E+1"), price_annual=Decimal("1.5E+2"))]
+    result = changesets._changeset_update_pricing_terms(pricing)
+    assert result["Details"]["Terms"][0]["RateCards"][0]["RateCard"] == [  # type: ignore
+        {"DimensionKey": "t2.nano", "Price": "10"}
+    ]
+    assert result["Details"]["Terms"][1]["RateCards"][0]["RateCard"] == [  # type: ignore
+        {"DimensionKey": "t2.nano", "Price": "150"}
+    ]
@@ -1,5 +1,5 @@
 import tempfile
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 
 import pytest
 import yaml
@@ -23,6 +23,18 @@ def test_offer_pricing_template(mock_get_client):
     assert results == ["m6i.xlarge,0.007,49.056", "r5d.24xlarge,0.168,1177.344", "t2.nano,0.002,12.264"]
 
 
+@patch("awsmp._driver.get_client")
+def test_offer_pricing_template_mismatched_dimensions(mock_get_client):
+    mock_get_client.return_value.describe_entity.return_value = {
+        "Details": '{"Terms":[{"Type":"UsageBasedPricingTerm","RateCards":[{"RateCard":[{"DimensionKey":"t2.nano","Price":"0.002"},{"DimensionKey":"m6i.xlarge","Price":"0.007"}]}]},{"Type":"ConfigurableUpfrontPricingTerm","RateCards":[{"RateCard":[{"DimensionKey":"t2.nano","Price":"12.264"}]}]}]}'
+    }
+    runner = CliRunner()
+    pricing_file = tempfile.NamedTemporaryFile()
+    result = runner.invoke(cli.offer_pricing_template, ["--offer-id", "some-offer-id", "--pricing", pricing_file.name])
+
+    assert str(result.exception) == "instance type dimensions are not identical in hourly and annual prices: m6i.xlarge"
+
+
 @patch("awsmp._driver.get_entity_details")
 @patch("awsmp._driver.get_client")
 def test_offer_create(mock_get_client, mock_get_entity_details):
@@ -46,6 +58,35 @@ def test_offer_create(mock_get_client, mock_get_entity_details):
     )
 
 
+@patch("awsmp._driver.list_entities")
+def test_entity_list_sorted_by_last_changed(mock_list_entities):
+    mock_list_entities.return_value = iter(
+        [
+            {"EntityId": "newer", "Name": "b", "Visibility": "Public", "LastModifiedDate": "2024-02-01T00:00:00Z"},
+            {"EntityId": "hidden", "Name": "c", "Visibility": "Limited", "LastModifiedDate": "2023-01-01T00:00:00Z"},
+            {"EntityId": "older", "Name": "a", "Visibility": "Public", "LastModifiedDate": "2023-06-01T00:00:00Z"},
+        ]
+    )
+    runner = CliRunner()
+    result = runner.invoke(cli.entity_list, ["AmiProduct", "--filter-visibility", "Public"])
+
+    assert "hidden" not in result.output
+    assert result.output.index("older") < result.output.index("newer")
+
+
+@patch("awsmp._driver.batch_get_entity_versions")
+@patch("awsmp._driver.list_entities")
+def test_entity_versions_count(mock_list_entities, mock_batch_get_entity_versions):
+    mock_list_entities.return_value = iter(
+        [{"EntityId": "prod-a", "Name": "product a"}, {"EntityId": "prod-b", "Name": "product b"}]
+    )
+    mock_batch_get_entity_versions.return_value = {"prod-a": [{}] * 3, "prod-b": [{}]}
+    runner = CliRunner()
+    result = runner.invoke(cli.entity_versions_count)
+
+    assert result.output == "prod-b - 1 - product b\nprod-a - 3 - product a\n"
+
+
 def test_ami_product_instance_type_template():
     """
     Test with invalid architecture argument
@@ -56,6 +97,21 @@ def test_ami_product_instance_type_template():
     assert isinstance(result.exception, SystemExit)
 
 
+@patch("awsmp._driver.get_client")
+def test_ami_product_instance_type_template_paginates(mock_get_client, tmp_path, monkeypatch):
+    mock_get_client.return_value.get_paginator.return_value.paginate.return_value = [
+        {"InstanceTypes": [{"InstanceType": "t2.nano"}, {"InstanceType": "t2.micro"}]},
+        {"InstanceTypes": [{"InstanceType": "m6i.xlarge"}]},
+    ]
+    monkeypatch.chdir(tmp_path)
+    runner = CliRunner()
+    runner.invoke(cli.ami_product_instance_type_template, ["--arch", "x86_64", "--virt", "hvm"])
+
+    results = (tmp_path / "instance_type.csv").read_text().splitlines()
+
+    assert results == ["t2.nano,0.0,0.0", "t2.micro,0.0,0.0", "m6i.xlarge,0.0,0.0"]
+
+
 @pytest.mark.parametrize(
     "missing_key, expected_exception, expected_message",
     [
@@ -67,8 +123,6 @@ def test_missing_keys_in_configuration(missing_key, expected_exception, expected
     """
     Test with missing keys in configuration.yaml file
     """
-    mock_path = MagicMock()
-    mock_path.name = "./tests/description.yaml"
-    with pytest.raises(expected_exception) as e:
-        cli._load_configuration(mock_path, missing_key)
+    with open("./tests/description.yaml") as config, pytest.raises(expected_exception) as e:
+        cli._load_configuration(config, missing_key)
     assert expected_message in str(e.value)
@@ -1,4 +1,4 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 import yaml
@@ -11,6 +11,7 @@ from awsmp.errors import (
     MissingInstanceTypeError,
     ResourceNotFoundException,
     UnrecognizedClientException,
+    ValidationException,
 )
 
 
@@ -22,7 +23,19 @@ class TestAmiProduct(object):
         mock_get_public_offer_id.return_value = "fake-offer-id"
         test_ami_product = _driver.AmiProduct(product_id="fake")
         assert test_ami_product.product_id == "fake"
+        mock_get_public_offer_id.assert_not_called()
         assert test_ami_product.offer_id == "fake-offer-id"
+        assert test_ami_product.offer_id == "fake-offer-id"
+        mock_get_public_offer_id.assert_called_once_with("fake")
+
+    @patch("awsmp._driver.get_public_offer_id")
+    @patch("awsmp._driver.get_entity_details")
+    def test_ami_product_title(self, mock_get_details, mock_get_public_offer_id):
+        mock_get_details.return_value = {"Description": {"ProductTitle": "Product XX.YY"}}
+        test_ami_product = _driver.AmiProduct(product_id="fake")
+        assert test_ami_product.product_title == "Product XX.YY"
+        assert test_ami_product.product_title == "Product XX.YY"
+        mock_get_details.assert_called_once_with("fake")
 
 
 @pytest.mark.parametrize(
@@ -66,9 +79,27 @@ def test_filter_instance_types(mock_get_details):
     assert res == changeset
 
 
+@patch("awsmp._driver.get_entity_details")
+def test_filter_instance_types_drops_unknown_types(mock_get_details):
+    mock_get_details.return_value = {"Dimensions": [{"Name": "foo"}]}
+    hourly = {"RateCards": [{"RateCard": [{"DimensionKey": "foo"}, {"DimensionKey": "bar"}]}]}
+    annual = {"RateCards": [{"RateCard": [{"DimensionKey": "bar"}, {"DimensionKey": "foo"}]}]}
+    changeset = [
+        None,
+        None,
+        None,
+        {"Details": {"Terms": [hourly, annual]}},
+    ]
+    res = _driver._filter_instance_types("product-id", changeset)
+    assert [term["RateCards"][0]["RateCard"] for term in res[3]["Details"]["Terms"]] == [
+        [{"DimensionKey": "foo"}],
+        [{"DimensionKey": "foo"}],
+    ]
+
+
 @patch("awsmp._driver.get_entity_details")
 def test_filter_instance_types_missing_types(mock_get_details):
-    mock_get_details.return_value = {"Dimensions": [{"Name": "foo"}, {"Name": "bar"}, {"Name": "baz"}]}
+    mock_get_details.return_value = {"Dimensions": [{"Name": "foo"}, {"Name": "bar"}, {"Name": "baz"}, {"Name": "aaa"}]}
     ratecards = {"RateCards": [{"RateCard": [{"DimensionKey": "foo"}, {"DimensionKey": "bar"}]}]}
     changeset = [
         None,
@@ -76,8 +107,9 @@ def test_filter_instance_types_missing_types(mock_get_details):
         None,
         {"Details": {"Terms": [ratecards, ratecards]}},
     ]
-    with pytest.raises(MissingInstanceTypeError):
+    with pytest.raises(MissingInstanceTypeError) as e:
         _driver._filter_instance_types("product-id", changeset)
+    assert str(e.value) == "The following instance types are missing from your pricing csv:\naaa\nbaz"
 
 
 @pytest.mark.parametrize(
@@ -150,6 +182,21 @@ def test_ami_product_create_with_wrong_credentials(mock_get_client):
     assert "This profile is not configured correctly" in excInfo.value.args[0]
 
 
+@pytest.mark.parametrize(
+    "error_code,expected_exception",
+    [
+        ("AccessDeniedException", AccessDeniedException),
+        ("UnrecognizedClientException", UnrecognizedClientException),
+        ("ResourceNotFoundException", ResourceNotFoundException),
+        ("ValidationException", ValidationException),
+    ],
+)
+def test_raise_client_error(error_code, expected_exception):
+    error = ClientError({"Error": {"Code": error_code, "Message": "some message"}}, "StartChangeSet")
+    with pytest.raises(expected_exception):
+        _driver._raise_client_error(error)
+
+
 @patch("awsmp._driver.get_client")
 def test_ami_product_create_without_permission(mock_get_client):
     mock_get_client.side_effect = AccessDeniedException(service_name="marketplace")
@@ -228,6 +275,7 @@ def test_ami_product_update_region_valid_values(mock_boto3, mock_get_client, val
     ap.update_regions(mock_region_config)
 
     assert mock_get_client.return_value.start_change_set.call_count == 1
+    mock_boto3.client.return_value.describe_regions.assert_called_once()
     assert (
         mock_get_client.return_value.start_change_set.call_args_list[0].kwargs["ChangeSet"][0]["Details"]
         == '{"Regions": ["eu-north-1"]}'
@@ -346,18 +394,66 @@ def test_ami_product_release(mock_get_client):
     )
 
 
+@patch("awsmp._driver.get_client")
+def test_list_entities(mock_get_client):
+    mock_get_client.return_value.get_paginator.return_value.paginate.return_value = [
+        {"EntitySummaryList": [{"EntityId": "first"}, {"EntityId": "second"}]},
+        {"EntitySummaryList": [{"EntityId": "third"}]},
+    ]
+    entities = _driver.list_entities("AmiProduct")
+    assert [e["EntityId"] for e in entities] == ["first", "second", "third"]
+
+
 @patch("awsmp._driver.get_entity_details")
 def test_get_entity_versions(mock_get_details):
     mock_get_details.return_value = {"Versions": [{"CreationDate": "20231010"}, {"CreationDate": "20230202"}]}
     assert _driver.get_entity_versions("foo") == [{"CreationDate": "20230202"}, {"CreationDate": "20231010"}]
 
 
+@patch("awsmp._driver.get_client")
+def test_get_entity_details_prefers_details_document(mock_get_client):
+    mock_get_client.return_value.describe_entity.return_value = {
+        "Details": '{"Versions": []}',
+        "DetailsDocument": {"Versions": [{"CreationDate": "20231010"}]},
+    }
+    assert _driver.get_entity_details("foo") == {"Versions": [{"CreationDate": "20231010"}]}
+
+
+@patch("awsmp._driver.get_client")
+def test_batch_get_entity_versions(mock_get_client):
+    mock_get_client.return_value.batch_describe_entities.return_value = {
+        "EntityDetails": {
+            "prod-a": {"DetailsDocument": {"Versions": [{"CreationDate": "20231010"}, {"CreationDate": "20230202"}]}},
+            "prod-b": {"DetailsDocument": {}},
+        },
+        "Errors": {},
+    }
+    assert _driver.batch_get_entity_versions(["prod-a", "prod-b"]) == {
+        "prod-a": [{"CreationDate": "20230202"}, {"CreationDate": "20231010"}],
+        "prod-b": [],
+    }
+    assert mock_get_client.return_value.batch_describe_entities.call_args.kwargs["EntityRequestList"] == [
+        {"Catalog": "AWSMarketplace", "EntityId": "prod-a"},
+        {"Catalog": "AWSMarketplace", "EntityId": "prod-b"},
+    ]
+
+
+@patch("awsmp._driver.get_entity_versions")
+@patch("awsmp._driver.get_client")
+def test_batch_get_entity_versions_without_batch_api(mock_get_client, mock_get_entity_versions):
+    mock_get_client.return_value = MagicMock(spec=["describe_entity"])
+    mock_get_entity_versions.return_value = []
+    assert _driver.batch_get_entity_versions(["prod-a"]) == {"prod-a": []}
+    mock_get_entity_versions.assert_called_once_with("prod-a")
+
+
 @patch("awsmp._driver.get_client")
 def test_get_public_offer_id(mock_get_client):
     mock_get_client.return_value.list_entities.return_value = {
         "EntitySummaryList": [{"EntityType": "Offer", "EntityId": "testing-public-offer-id"}]
     }
     assert _driver.get_public_offer_id("testing") == "testing-public-offer-id"
+    assert mock_get_client.return_value.list_entities.call_args.kwargs["MaxResults"] == 1
 
 
 @patch("awsmp._driver.get_client")
@@ -365,3 +461,36 @@ def test_get_public_no_offer_id(mock_get_client):
     mock_get_client.return_value.list_entities.return_value = {"EntitySummaryList": []}
     with pytest.raises(ResourceNotFoundException):
         _driver.get_public_offer_id("no-offer-id")
+
+
+@patch("awsmp._driver.boto3")
+def test_get_client_is_cached(mock_boto3):
+    _driver.get_client.cache_clear()
+    try:
+        assert _driver.get_client() is _driver.get_client()
+        mock_boto3.client.assert_called_once_with(
+            "marketplace-catalog", region_name="us-east-1", config=_driver._BOTO_CONFIG
+        )
+    finally:
+        _driver.get_client.cache_clear()
+
+
+@patch("awsmp._driver.get_client")
+def test_get_response_sanitizes_changeset_name(mock_get_client):
+    _driver.get_response([], "Offer - 123,456 - Product (XX.YY)")  # type: ignore
+    mock_start_change_set = mock_get_client.return_value.start_change_set
+    assert mock_start_change_set.call_args.kwargs["ChangeSetName"] == "Offer - 123_456 - Product XX.YY"
+
+
+@patch("awsmp._driver.get_client")
+def test_get_entity_details_is_cached(mock_get_client):
+    mock_describe_entity = mock_get_client.return_value.describe_entity
+    mock_describe_entity.return_value = {"Details": '{"Versions": []}'}
+    assert _driver.get_entity_details("foo") == {"Versions": []}
+    assert _driver.get_entity_details("foo") is _driver.get_entity_details("foo")
+    assert mock_describe_entity.call_count == 1
+
+    # starting a change set drops cached lookups
+    _driver.get_response([], "some change")  # type: ignore
+    _driver.get_entity_details("foo")
+    assert mock_describe_entity.call_count == 2